@@ -0,0 +1,474 @@
+"""
+An example multi-user chat gateway built using the LlmProcessingUnit.
+
+Serves many concurrent conversations over HTTP from a single asyncio
+process. Each conversation has its own LlmProcessingUnit, and the
+memory of conversations that have gone idle is saved to disk and
+dropped, least recently used first, once more than '--max-resident'
+are held in memory. It is loaded back the next time the conversation
+is used.
+
+    POST   /conversations/<id>   send the request body as the next user
+                                 message, answers the reply as JSON, or
+                                 with '?stream=1' streams the reply as
+                                 chunked plain text as it is generated
+    DELETE /conversations/<id>   forget a conversation
+    GET    /stats                answer gateway statistics as JSON
+
+To run from the project top level make sure you have activated your
+.venv and then do `python -m llmpu.examples.gateway`. There's a stand in
+model server for load testing at `python -m llmpu.examples.stand_in_server`
+"""
+
+import asyncio
+import json
+import re
+import requests
+
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable
+from urllib.parse import parse_qs, urlsplit
+
+import llmpu.sessions as sessions
+import llmpu.formatters as formatters
+
+from llmpu import LlmProcessingUnit
+
+TRANSCRIPT_MEMSLOT = ["ChatTranscript0"]
+CONVERSATION_PATH = re.compile(r"^/conversations/([A-Za-z0-9_-]{1,64})$")
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    502: "Bad Gateway",
+}
+
+# errors from a failed or garbled exchange with the AI server
+BACKEND_ERRORS = (
+    sessions.SessionError,
+    requests.RequestException,
+    ValueError,
+    KeyError,
+)
+
+
+class Conversation:
+    def __init__(self, llm: LlmProcessingUnit):
+        self.llm = llm
+        self.lock = asyncio.Lock()
+        self.users = 0
+        self.loaded = True
+
+
+class ConversationStore:
+    """
+    Holds the processing unit for each conversation, keeping at most
+    'max_resident' of them in memory and spilling the memory of the
+    least recently used ones to JSON files in 'spill_dir'.
+    """
+
+    def __init__(
+        self,
+        session: sessions.BaseSession,
+        executor: ThreadPoolExecutor,
+        spill_dir: Path,
+        max_resident: int = 1024,
+        system_prompt: str = None,
+    ):
+        self._session = session
+        self._executor = executor
+        self._spill_dir = spill_dir
+        self._max_resident = max_resident
+        self._system_prompt = system_prompt
+        self._resident: OrderedDict[str, Conversation] = OrderedDict()
+        self._spilling: dict[str, Conversation] = {}
+        self.spills = 0
+        self.loads = 0
+
+        self._spill_dir.mkdir(parents=True, exist_ok=True)
+
+    def _spill_path(self, conversation_id: str) -> Path:
+        return self._spill_dir / f"{conversation_id}.json"
+
+    async def run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, func, *args
+        )
+
+    @asynccontextmanager
+    async def checkout(self, conversation_id: str):
+        """
+        Answer the conversation with the passed id, loading it from disk
+        or starting a new one if it isn't currently resident. The
+        conversation will not be evicted while it is checked out.
+        """
+        conversation = self._resident.get(conversation_id)
+        if conversation is not None:
+            self._resident.move_to_end(conversation_id)
+        elif conversation_id in self._spilling:
+            # a conversation still being saved can just be taken back
+            conversation = self._spilling.pop(conversation_id)
+            self._resident[conversation_id] = conversation
+        else:
+            conversation = self._new(conversation_id)
+
+        conversation.users += 1
+        try:
+            await self._load(conversation_id, conversation)
+            await self._evict()
+            yield conversation
+        finally:
+            conversation.users -= 1
+
+    def _new(self, conversation_id: str) -> Conversation:
+        llm = LlmProcessingUnit(self._session)
+        if self._system_prompt is not None:
+            llm.load_sys(self._system_prompt)
+
+        conversation = Conversation(llm)
+        conversation.loaded = not self._spill_path(conversation_id).exists()
+        self._resident[conversation_id] = conversation
+        return conversation
+
+    async def _load(self, conversation_id: str, conversation: Conversation):
+        async with conversation.lock:
+            if conversation.loaded:
+                return
+
+            llm = conversation.llm
+            await self.run_blocking(llm.load_mem, self._spill_path(conversation_id))
+            try:
+                llm.load_context(0, TRANSCRIPT_MEMSLOT)
+            except KeyError:
+                # spilled before its first reply arrived
+                pass
+            conversation.loaded = True
+            self.loads += 1
+
+    async def _evict(self):
+        # skip over any conversations that are checked out, they'll be
+        # considered again next time
+        for conversation_id in list(self._resident):
+            if len(self._resident) <= self._max_resident:
+                break
+
+            conversation = self._resident.get(conversation_id)
+            if conversation is None or conversation.users:
+                continue
+
+            del self._resident[conversation_id]
+            spill_path = self._spill_path(conversation_id)
+            if not conversation.llm.read_context(0):
+                # nothing to save until the conversation's had a reply
+                spill_path.unlink(missing_ok=True)
+                continue
+
+            self._spilling[conversation_id] = conversation
+            async with conversation.lock:
+                await self.run_blocking(conversation.llm.save_mem, spill_path)
+            self.spills += 1
+
+            # the conversation may have been forgotten while it was saved
+            forgotten = self._spilling.pop(conversation_id, None) is None
+            if forgotten and conversation_id not in self._resident:
+                spill_path.unlink(missing_ok=True)
+
+    def forget(self, conversation_id: str) -> bool:
+        """
+        Forget the conversation with the passed id, answering whether
+        there was one to forget
+        """
+        found = self._resident.pop(conversation_id, None) is not None
+        found = self._spilling.pop(conversation_id, None) is not None or found
+        spill_path = self._spill_path(conversation_id)
+        if spill_path.exists():
+            spill_path.unlink()
+            found = True
+
+        return found
+
+    def stats(self) -> dict:
+        return {
+            "resident": len(self._resident),
+            "max_resident": self._max_resident,
+            "spills": self.spills,
+            "loads": self.loads,
+        }
+
+
+class ChatGateway:
+    """
+    A minimal asyncio HTTP/1.1 server, with keep-alive, that passes
+    each conversation's messages to its processing unit
+    """
+
+    def __init__(self, store: ConversationStore):
+        self._store = store
+        self._open_connections = 0
+        self._in_flight = 0
+
+    async def chat(
+        self,
+        conversation_id: str,
+        user_input: str,
+        on_content: Callable[[str], None] = None,
+    ) -> dict:
+        async with (
+            self._store.checkout(conversation_id) as conversation,
+            conversation.lock,
+        ):
+            llm = conversation.llm
+            llm.load_ins(user_input)
+
+            self._in_flight += 1
+            try:
+                await self._store.run_blocking(
+                    partial(
+                        llm.evaluate,
+                        ["system", "context0", "instruction"],
+                        on_content=on_content,
+                    )
+                )
+            finally:
+                self._in_flight -= 1
+
+            llm.push("instruction", TRANSCRIPT_MEMSLOT)
+            llm.push("result", TRANSCRIPT_MEMSLOT)
+            llm.load_context(0, TRANSCRIPT_MEMSLOT)
+
+            return {
+                "role": llm.read_result().role,
+                "content": llm.read_result().content,
+            }
+
+    async def reply(
+        self,
+        conversation_id: str,
+        body: bytes,
+        on_content: Callable[[str], None] = None,
+    ) -> tuple[int, dict]:
+        """
+        Answer the status and payload for a chat message
+        """
+        try:
+            return 200, await self.chat(conversation_id, body.decode(), on_content)
+        except UnicodeDecodeError:
+            return 400, {"error": "message must be utf-8 text"}
+        except BACKEND_ERRORS as error:
+            return 502, {"error": f"AI server request failed: {error!r}"}
+
+    async def stream_reply(
+        self,
+        writer: asyncio.StreamWriter,
+        conversation_id: str,
+        body: bytes,
+        keep_alive: bool,
+    ) -> bool:
+        """
+        Stream the reply to a chat message as chunked plain text, writing
+        each piece as it arrives from the AI server. Errors before the
+        first piece are answered as JSON, after it the connection is
+        closed without ending the chunked body. Answers whether the
+        connection can be kept alive.
+        """
+        loop = asyncio.get_running_loop()
+        pieces: asyncio.Queue[str | None] = asyncio.Queue()
+
+        def on_content(text: str):
+            # called from the executor thread running the request
+            loop.call_soon_threadsafe(pieces.put_nowait, text)
+
+        reply = asyncio.ensure_future(self.reply(conversation_id, body, on_content))
+        reply.add_done_callback(lambda _: pieces.put_nowait(None))
+
+        started = False
+        while (text := await pieces.get()) is not None:
+            if not started:
+                self._write_chunked_head(writer, keep_alive)
+                started = True
+            data = text.encode()
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+
+        status, payload = reply.result()
+        if status != 200:
+            if started:
+                return False
+            await self._respond(writer, status, payload, keep_alive)
+            return keep_alive
+
+        if not started:
+            self._write_chunked_head(writer, keep_alive)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return keep_alive
+
+    async def route(self, method: str, target: str, body: bytes) -> tuple[int, dict]:
+        if target == "/stats":
+            if method != "GET":
+                return 405, {"error": "method not allowed"}
+            return 200, self._store.stats() | {
+                "open_connections": self._open_connections,
+                "in_flight": self._in_flight,
+            }
+
+        match = CONVERSATION_PATH.match(target)
+        if match is None:
+            return 404, {"error": "not found"}
+
+        conversation_id = match.group(1)
+        if method == "POST":
+            return await self.reply(conversation_id, body)
+        elif method == "DELETE":
+            if self._store.forget(conversation_id):
+                return 200, {"deleted": conversation_id}
+            return 404, {"error": "not found"}
+
+        return 405, {"error": "method not allowed"}
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        self._open_connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                try:
+                    method, target, version = request_line.decode().split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "bad request"}, False)
+                    break
+
+                try:
+                    headers = {}
+                    while (line := await reader.readline()) not in (
+                        b"\r\n",
+                        b"\n",
+                        b"",
+                    ):
+                        name, _, value = line.decode().partition(":")
+                        headers[name.strip().lower()] = value.strip()
+
+                    content_length = int(headers.get("content-length", 0))
+                    if content_length < 0:
+                        raise ValueError("negative content length")
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "bad request"}, False)
+                    break
+
+                body = await reader.readexactly(content_length)
+                keep_alive = (
+                    headers.get("connection", "").lower() != "close"
+                    and version == "HTTP/1.1"
+                )
+
+                url = urlsplit(target)
+                match = CONVERSATION_PATH.match(url.path)
+                if (
+                    method == "POST"
+                    and match is not None
+                    and parse_qs(url.query).get("stream") == ["1"]
+                ):
+                    keep_alive = await self.stream_reply(
+                        writer, match.group(1), body, keep_alive
+                    )
+                else:
+                    status, payload = await self.route(method, url.path, body)
+                    await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._open_connections -= 1
+            writer.close()
+
+    def _write_chunked_head(self, writer: asyncio.StreamWriter, keep_alive: bool):
+        writer.write(
+            (
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: text/plain; charset=utf-8\r\n"
+                "Transfer-Encoding: chunked\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                "\r\n"
+            ).encode()
+        )
+
+    async def _respond(
+        self, writer: asyncio.StreamWriter, status: int, payload: dict, keep_alive: bool
+    ):
+        body = json.dumps(payload).encode()
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                "\r\n"
+            ).encode()
+            + body
+        )
+        await writer.drain()
+
+
+async def serve(gateway: ChatGateway, host: str, port: int):
+    server = await asyncio.start_server(gateway.handle_connection, host, port)
+    print(f"LLMpu example: Chat gateway listening on http://{host}:{port}/")
+
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    sessions.add_args(parser)
+    formatters.add_args(parser)
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="maximum number of requests in flight to the AI server",
+    )
+    parser.add_argument(
+        "--max-resident",
+        type=int,
+        default=1024,
+        help="maximum number of conversations to hold in memory",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        type=Path,
+        default=Path("./gateway_conversations"),
+        help="directory to save idle conversations to",
+    )
+    parser.add_argument(
+        "--system-prompt", type=str, default=None, help="system prompt for all chats"
+    )
+    args = parser.parse_args()
+
+    session = sessions.from_args(args)
+    session.processors = [formatters.from_args(args)]
+
+    store = ConversationStore(
+        session,
+        ThreadPoolExecutor(max_workers=args.workers),
+        args.spill_dir,
+        args.max_resident,
+        args.system_prompt,
+    )
+    asyncio.run(serve(ChatGateway(store), args.host, args.port))
@@ -0,0 +1,89 @@
+"""
+A stand in for an OpenAI chat completions compatible AI server, for
+load testing examples such as the chat gateway without a real model.
+It answers every request by echoing the last message back after a
+configurable delay, streamed a word at a time if the request asks for
+streaming.
+
+To run from the project top level make sure you have activated your
+.venv and then do `python -m llmpu.examples.stand_in_server`
+"""
+
+import json
+import re
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay: float = 0.0
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        last_message = request["messages"][-1]["content"] if request["messages"] else ""
+
+        time.sleep(self.delay)
+        if request.get("stream"):
+            self._stream(last_message)
+            return
+
+        body = json.dumps(
+            {
+                "object": "chat.completion",
+                "model": request.get("model", "stand-in"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": last_message},
+                        "finish_reason": "stop",
+                    }
+                ],
+            }
+        ).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, content: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        pieces = [
+            {"role": "assistant", "content": word}
+            for word in re.findall(r"\S*\s*", content)
+            if word
+        ]
+        for delta in pieces or [{"role": "assistant", "content": ""}]:
+            chunk = {"choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=5001, help="port to listen on")
+    parser.add_argument(
+        "--delay", type=float, default=0.1, help="seconds to wait before answering"
+    )
+    args = parser.parse_args()
+
+    StandInHandler.delay = args.delay
+    print(f"LLMpu example: Stand in AI server on http://{args.host}:{args.port}/")
+    ThreadingHTTPServer((args.host, args.port), StandInHandler).serve_forever()
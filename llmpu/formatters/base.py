@@ -11,5 +11,12 @@ class BaseSessionFormatter:
     def uses_characters(self):
         return False
 
+    @property
+    def stop_words(self) -> list[str]:
+        """
+        Sequences that mark the end of the model's response in this format
+        """
+        return []
+
     def apply(self, history: list[HistoryTurn]) -> list:
         return history
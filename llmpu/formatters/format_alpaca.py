@@ -10,8 +10,8 @@ class AlpacaSessionFormatter(BaseSessionFormatter):
     """
 
     @property
-    def stop_words():
-        return "### Instruction:\n"
+    def stop_words(self) -> list[str]:
+        return ["### Instruction:\n"]
 
     def apply(self, turns: list[HistoryTurn]):
         # Alpaca-ify session
@@ -10,7 +10,7 @@ class Llama3SessionFormatter(BaseSessionFormatter):
     """
 
     @property
-    def stop_words():
+    def stop_words(self) -> list[str]:
         return ["<|end_of_text|>"]
 
     def apply(self, history: list[HistoryTurn]):
@@ -35,7 +35,7 @@ class Llama3InstructSessionFormatter(BaseSessionFormatter):
     """
 
     @property
-    def stop_words():
+    def stop_words(self) -> list[str]:
         return ["<|eot_id|>", "<|end_of_text|>"]
 
     def apply(self, turns: list[HistoryTurn]):
@@ -1,10 +1,68 @@
 import json
 
 from pathlib import Path
-from typing import Self
+from typing import Callable, Self
 
-from llmpu.sessions import BaseSession
+from llmpu.sessions import BaseSession, Jsonable, read_batch_results
 from llmpu.history import HistoryTurn, HistoryJSONEncoder, HistoryJSONDecoder
+from llmpu.memory import (
+    ContentStore,
+    TieredMemory,
+    TieredMemoryJSONEncoder,
+    is_deduplicated,
+    load_deduplicated,
+)
+from llmpu.tracing import Tracer, traced
+
+
+def _chars(value: HistoryTurn | list[HistoryTurn] | None) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, HistoryTurn):
+        return len(value.content)
+    return sum(len(turn.content) for turn in value)
+
+
+def _describe_load(llm: "LlmProcessingUnit", args: dict) -> dict:
+    if isinstance(args["value"], list):
+        return {"mem_path": args["value"]}
+    return {"payload_chars": len(args["value"])}
+
+
+def _describe_register_op(llm: "LlmProcessingUnit", args: dict) -> dict:
+    return {
+        "register": args["register"],
+        "mem_path": args["mem_path"],
+        "payload_chars": _chars(llm._registers[args["register"]]),
+    }
+
+
+def _describe_load_context(llm: "LlmProcessingUnit", args: dict) -> dict:
+    register = f"context{args['reg_idx']}"
+    return {
+        "register": register,
+        "mem_path": args["mem_path"],
+        "payload_chars": _chars(llm._registers[register]),
+    }
+
+
+def _describe_evaluate(llm: "LlmProcessingUnit", args: dict) -> dict:
+    return {
+        "registers": args["registers"],
+        "payload_chars": sum(
+            _chars(llm._registers[register]) for register in args["registers"]
+        ),
+        "result_chars": _chars(llm._registers["result"]),
+        "structured": bool(args["structured"]),
+    }
+
+
+def _describe_file(llm: "LlmProcessingUnit", args: dict) -> dict:
+    file_path = Path(args["file_path"])
+    return {
+        "file_path": str(file_path),
+        "file_bytes": file_path.stat().st_size if file_path.exists() else None,
+    }
 
 
 class LlmProcessingUnit:
@@ -27,11 +85,18 @@ class LlmProcessingUnit:
     location stack.
 
     The entire memory dictionary can be saved and loaded from a file with
-    'save_mem' and 'load_mem' methods.
+    'save_mem' and 'load_mem' methods. Passing a TieredMemory keeps the
+    memory within a RAM budget, spilling the least recently used memory
+    locations to disk and transparently loading them back when accessed.
+    Passing a ContentStore keeps only one copy of any turn content pushed
+    to several memory locations, both in memory and in saved files.
 
     Finally 'evaluate' is used to send the turns in the selected registers
     to the LLM. The LLM's response is then placed as turn in the Result
     register.
+
+    Passing a Tracer records every load, push, pop, peek, evaluate and
+    memory save or load operation, for working out where the time goes.
     """
 
     def __init__(
@@ -39,8 +104,12 @@ class LlmProcessingUnit:
         session: BaseSession,
         memory: dict[str, HistoryTurn | list[HistoryTurn]] = None,
         context_registers: int = 3,
+        tiered_memory: TieredMemory = None,
+        content_store: ContentStore = None,
+        tracer: Tracer = None,
     ):
         self._session: BaseSession = session
+        self._tracer: Tracer = tracer
         self._context_registers = context_registers
         self._registers: dict[str, str | list[str]] = {
             "system": [],
@@ -49,21 +118,78 @@ class LlmProcessingUnit:
         }
         for idx in range(context_registers):
             self._registers[f"context{idx}"] = None
+        self._parsed_result: Jsonable = None
 
         # TODO typing is not correct here needs to be recursive. See
         # Jsonable in session.base for an example
         self._memory: dict[str, str | list[str]] = dict() if memory is None else memory
 
+        self._content_store = content_store
+        if content_store is not None:
+            content_store.intern_all(self._memory)
+
+        self._tiered_memory = tiered_memory
+        if tiered_memory is not None:
+            tiered_memory.attach(
+                self._memory, None if content_store is None else content_store.intern
+            )
+
+    @property
+    def tracer(self) -> Tracer:
+        return self._tracer
+
+    @tracer.setter
+    def tracer(self, value: Tracer):
+        self._tracer = value
+
+    @property
+    def tiered_memory(self) -> TieredMemory:
+        return self._tiered_memory
+
+    @property
+    def content_store(self) -> ContentStore:
+        return self._content_store
+
     def _get_mem_location(self, path: list[str, int]):
+        parent = None
         current = self._memory
         for key in path:
             if key in current:
-                current = current[key]
+                parent, current = current, current[key]
             else:
                 raise KeyError(f"Invalid memory path: '{path}'")
 
+        if self._tiered_memory is not None and not isinstance(current, dict):
+            current = self._tiered_memory.access(parent, path)
+
         return current
 
+    def _append_mem(self, mem_path: list[str | int], turns: list[HistoryTurn]):
+        if self._content_store is not None:
+            turns = [self._content_store.intern(turn) for turn in turns]
+
+        # None keys along the path are skipped
+        mem_path = [key for key in mem_path[:-1] if key is not None] + mem_path[-1:]
+
+        current = self._memory
+        for key in mem_path[:-1]:
+            if key not in current:
+                current[key] = dict()
+            current = current[key]
+
+        if self._tiered_memory is not None and mem_path[-1] in current:
+            self._tiered_memory.access(current, mem_path)
+
+        leaf_value = current.get(mem_path[-1], list())
+        if isinstance(leaf_value, list):
+            current[mem_path[-1]] = leaf_value + turns
+        else:
+            raise ValueError(f"Invalid memory location for push: {mem_path}")
+
+        if self._tiered_memory is not None:
+            self._tiered_memory.update(mem_path, current[mem_path[-1]])
+
+    @traced("load_sys", _describe_load)
     def load_sys(self, value: str | list[str]):
         """
         Load the passed value or the contents of the passed memory location
@@ -72,12 +198,13 @@ class LlmProcessingUnit:
         content = value
         if isinstance(value, list):
             content = "\n\n".join(
-                [value.content for turn in self._get_mem_location(value)]
+                [turn.content for turn in self._get_mem_location(value)]
             )
 
         self._registers["system"] = [HistoryTurn(role="system", content=content)]
         return self
 
+    @traced("load_ins", _describe_load)
     def load_ins(self, value: str | list[str]):
         """
         Load the passed value into the instruction register as a single turn.
@@ -85,12 +212,13 @@ class LlmProcessingUnit:
         content = value
         if isinstance(value, list):
             content = "\n\n".join(
-                [value.content for turn in self._get_mem_location(value)]
+                [turn.content for turn in self._get_mem_location(value)]
             )
 
         self._registers["instruction"] = [HistoryTurn(role="user", content=content)]
         return self
 
+    @traced("load_context", _describe_load_context)
     def load_context(self, reg_idx: int, mem_path: list[str | int]):
         """
         Load the list of turns at a the passed memory dictionary location
@@ -133,6 +261,15 @@ class LlmProcessingUnit:
         """
         return self._registers["result"][0] if self._registers["result"] else None
 
+    def read_parsed(self) -> Jsonable:
+        """
+        Answer the parsed JSON from the last structured evaluate, or None if
+        it wasn't structured, the response wasn't valid JSON, or the result
+        register has since been replaced
+        """
+        return self._parsed_result
+
+    @traced("push", _describe_register_op)
     def push(self, register: str, mem_path: list[str]):
         """
         Push any turns in a register onto the end of the list of turns
@@ -143,21 +280,10 @@ class LlmProcessingUnit:
         if register not in self._registers:
             raise ValueError(f"Unknown register '{register}'")
 
-        current = self._memory
-        for key in mem_path[:-1]:
-            if key is not None:
-                if key not in current:
-                    current[key] = dict()
-                current = current[key]
-
-        leaf_value = current.get(mem_path[-1], list())
-        if isinstance(leaf_value, list):
-            current[mem_path[-1]] = leaf_value + self._registers[register]
-        else:
-            raise ValueError(f"Invalid memory location for push: {mem_path}")
-
+        self._append_mem(mem_path, self._registers[register])
         return self
 
+    @traced("pop", _describe_register_op)
     def pop(self, mem_path: list[str], register: str):
         """
         Pop the last list turn at a memory dictionary location into the
@@ -173,9 +299,7 @@ class LlmProcessingUnit:
         if register not in self._registers:
             raise ValueError(f"Unknown register {register}")
 
-        leaf_key = mem_path[-1]
-        mem_parent = self._get_mem_location(mem_path[:-1])
-        mem_value = mem_parent[leaf_key]
+        mem_value = self._get_mem_location(mem_path)
         if not isinstance(mem_value, list):
             raise ValueError(f"Invalid memory location for pop: {mem_path}")
 
@@ -185,9 +309,15 @@ class LlmProcessingUnit:
             self.load_ins(mem_value.pop().content)
         else:
             self._registers[register] = mem_value.pop()
+            if register == "result":
+                self._parsed_result = None
+
+        if self._tiered_memory is not None:
+            self._tiered_memory.update(mem_path, mem_value)
 
         return self
 
+    @traced("peek", _describe_register_op)
     def peek(self, mem_path: list[str], register: str):
         """
         Copy the last list turn at a memory dictionary location into the
@@ -202,9 +332,7 @@ class LlmProcessingUnit:
         if register not in self._registers:
             raise ValueError(f"Unknown register {register}")
 
-        leaf_key = mem_path[-1]
-        mem_parent = self._get_mem_location(mem_path[:-1])
-        mem_value = mem_parent[leaf_key]
+        mem_value = self._get_mem_location(mem_path)
         if not isinstance(mem_value, list):
             raise ValueError(f"Invalid memory location for pop: {mem_path}")
 
@@ -214,6 +342,8 @@ class LlmProcessingUnit:
             self.load_ins(mem_value[-1].content)
         else:
             self._registers[register] = mem_value[-1]
+            if register == "result":
+                self._parsed_result = None
 
         return self
 
@@ -225,6 +355,8 @@ class LlmProcessingUnit:
             raise ValueError(f"Unknown register '{register}'")
 
         self._registers[register] = None
+        if register == "result":
+            self._parsed_result = None
         return self
 
     def clear_mem(self, mem_path: list[str]):
@@ -235,15 +367,30 @@ class LlmProcessingUnit:
 
         leaf_key = mem_path[-1]
         mem_parent = self._get_mem_location(mem_path[:-1])
+        if self._tiered_memory is not None and leaf_key in mem_parent:
+            self._tiered_memory.forget(mem_path)
+
         mem_parent.pop(leaf_key, None)
         return self
 
+    @traced("evaluate", _describe_evaluate)
     def evaluate(
-        self, registers: list[str] = ["system", "context0", "instruction"]
+        self,
+        registers: list[str] = ["system", "context0", "instruction"],
+        structured: bool | dict = None,
+        extra_props: dict = None,
+        on_content: Callable[[str], None] = None,
     ) -> Self:
         """
         Sends a request to the LLM to evaluate a context built from the passed
         registers, placing the answer in the the 'result' register.
+
+        If 'structured' is True the LLM is asked for a JSON object, or if it is
+        a dict for JSON following that schema, which is parsed as the response
+        arrives and can be read back with 'read_parsed'. 'extra_props' are
+        passed to the session for just this request, such as a grammar.
+        If 'on_content' is passed the response is streamed, calling it with
+        each piece of the answer as it arrives.
         """
 
         full_context: list[HistoryTurn] = [
@@ -253,34 +400,96 @@ class LlmProcessingUnit:
             for turn in self._registers[register]
         ]
 
+        options = dict()
+        if structured:
+            options["structured"] = structured
+        if extra_props is not None:
+            options["extra_props"] = extra_props
+        if on_content is not None:
+            options["on_content"] = on_content
+
+        response = dict(self._session.get_response(full_context, **options))
+        self._parsed_result = response.pop("parsed", None)
         self._registers["result"] = [
             HistoryTurn(
-                **self._session.get_response(full_context),
+                **response,
             )
         ]
         return self
 
+    def ingest_batch(self, file_path: Path | str) -> Self:
+        """
+        Reads a batch results file for requests written by a
+        BatchFileSession, pushing each completion as a turn onto the
+        memory location recorded in its request's custom id. Failed
+        requests are skipped and counted.
+        """
+
+        ingested = 0
+        failed = 0
+        for mem_path, message, _ in read_batch_results(file_path):
+            if message is None:
+                failed += 1
+                continue
+
+            self._append_mem(
+                mem_path,
+                [HistoryTurn(role=message["role"], content=message["content"])],
+            )
+            ingested += 1
+
+        print(f"ingested: {file_path} ({ingested} results, {failed} failed)")
+        return self
+
+    @traced("load_mem", _describe_file)
     def load_mem(self, file_path: Path | str) -> Self:
         """
-        loads the memory from a JSON file
+        loads the memory from a JSON file, in either the plain or the
+        deduplicated format
         """
 
         if Path(file_path).exists():
             with open(file_path) as file:
                 self._memory = json.load(file, cls=HistoryJSONDecoder)
 
+            if is_deduplicated(self._memory):
+                self._memory = load_deduplicated(self._memory)
+            if self._content_store is not None:
+                self._content_store.intern_all(self._memory)
+
+            if self._tiered_memory is not None:
+                intern = (
+                    None if self._content_store is None else self._content_store.intern
+                )
+                self._tiered_memory.attach(self._memory, intern)
+
             print(f"loaded: {file_path}")
         else:
             print(f"not found: {file_path}")
 
         return self
 
+    @traced("save_mem", _describe_file)
     def save_mem(self, file_path: Path | str) -> Self:
         """
-        saves the memory to a JSON file
+        saves the memory to a JSON file, in the deduplicated format if
+        there is a content store
         """
 
         with open(file_path, mode="w+") as file:
-            json.dump(self._memory, file, indent=4, cls=HistoryJSONEncoder)
+            if self._content_store is not None:
+                self._content_store.dump(self._memory, file)
+                return self
+
+            json.dump(
+                self._memory,
+                file,
+                indent=4,
+                cls=(
+                    HistoryJSONEncoder
+                    if self._tiered_memory is None
+                    else TieredMemoryJSONEncoder
+                ),
+            )
 
         return self
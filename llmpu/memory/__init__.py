@@ -0,0 +1,10 @@
+from .tiered import (
+    TieredMemory,
+    TieredMemoryJSONEncoder,
+    SpilledTurns,
+)
+from .content import (
+    ContentStore,
+    is_deduplicated,
+    load_deduplicated,
+)
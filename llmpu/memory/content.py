@@ -0,0 +1,168 @@
+import base64
+import hashlib
+import json
+import weakref
+import zlib
+
+from typing import IO
+
+from llmpu.history import HistoryTurn
+from .tiered import SpilledTurns
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEDUP_FORMAT = "llmpu-dedup-1"
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class _SharedContent(str):
+    # a plain str can't be weakly referenced
+    __slots__ = ("__weakref__",)
+
+
+def _compress(content: str, codec: str) -> str:
+    data = content.encode()
+    if codec == "zlib":
+        data = zlib.compress(data)
+    elif codec == "zstd":
+        data = zstandard.ZstdCompressor().compress(data)
+    return base64.b64encode(data).decode("ascii")
+
+
+def _decompress(data: str, codec: str) -> str:
+    raw = base64.b64decode(data)
+    if codec == "zlib":
+        return zlib.decompress(raw).decode()
+    elif codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compressed memory needs the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(raw).decode()
+
+    raise ValueError(f"Unknown compression codec: '{codec}'")
+
+
+class ContentStore:
+    """
+    A content addressed store for turn content, so that the same text
+    pushed to many memory locations is only held once.
+
+    Turns passed through 'intern' share a single copy of their content
+    in RAM, which is only held for as long as some turn refers to it,
+    and memory saved with 'dump' stores each distinct piece of
+    content once, keyed by its hash, with turns referring to it by that
+    hash. Content at least 'compress_min_size' characters long is
+    compressed on disk with the 'compression' codec, either 'zlib' or,
+    if the zstandard package is installed, 'zstd'.
+    """
+
+    def __init__(self, compression: str = None, compress_min_size: int = 1024):
+        if compression not in (None, "zlib", "zstd"):
+            raise ValueError(f"Unknown compression codec: '{compression}'")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+
+        self._compression = compression
+        self._compress_min_size = compress_min_size
+        self._contents: weakref.WeakValueDictionary[str, _SharedContent] = (
+            weakref.WeakValueDictionary()
+        )
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+    def intern(self, turn: HistoryTurn) -> HistoryTurn:
+        """
+        Answer a turn like the passed one whose content is the single
+        shared copy held by the store
+        """
+        digest = content_hash(turn.content)
+        content = self._contents.get(digest)
+        if content is None:
+            content = _SharedContent(turn.content)
+            self._contents[digest] = content
+
+        if content is turn.content:
+            return turn
+        return HistoryTurn(role=turn.role, content=content)
+
+    def intern_all(self, node):
+        """
+        Intern all the turns in the passed memory dictionary, in place
+        """
+        for key, value in node.items():
+            if isinstance(value, dict):
+                self.intern_all(value)
+            elif isinstance(value, list):
+                node[key] = [self.intern(turn) for turn in value]
+
+    def dump(self, memory: dict, file: IO):
+        """
+        Write the passed memory dictionary to a file in the deduplicated
+        format
+        """
+        blobs: dict[str, str | dict] = dict()
+
+        def ref(turn: HistoryTurn) -> dict:
+            digest = content_hash(turn.content)
+            if digest not in blobs:
+                if (
+                    self._compression is not None
+                    and len(turn.content) >= self._compress_min_size
+                ):
+                    blobs[digest] = {
+                        "codec": self._compression,
+                        "data": _compress(turn.content, self._compression),
+                    }
+                else:
+                    blobs[digest] = turn.content
+            return {"role": turn.role, "ref": digest}
+
+        def walk(node):
+            if isinstance(node, dict):
+                return {key: walk(value) for key, value in node.items()}
+            if isinstance(node, SpilledTurns):
+                node = node.load()
+            return [ref(turn) for turn in node]
+
+        json.dump(
+            {"format": DEDUP_FORMAT, "blobs": blobs, "memory": walk(memory)},
+            file,
+            indent=4,
+        )
+
+
+def is_deduplicated(data) -> bool:
+    """
+    Answer whether the passed JSON data is memory in the deduplicated format
+    """
+    return isinstance(data, dict) and data.get("format") == DEDUP_FORMAT
+
+
+def load_deduplicated(data: dict) -> dict:
+    """
+    Answer a memory dictionary rebuilt from JSON data written by
+    'ContentStore.dump'. Each distinct piece of content is only
+    decoded once, and shared by all the turns that refer to it.
+    """
+    contents = {
+        digest: (
+            blob if isinstance(blob, str) else _decompress(blob["data"], blob["codec"])
+        )
+        for digest, blob in data["blobs"].items()
+    }
+
+    def walk(node):
+        if isinstance(node, dict):
+            return {key: walk(value) for key, value in node.items()}
+        return [
+            HistoryTurn(role=turn["role"], content=contents[turn["ref"]])
+            for turn in node
+        ]
+
+    return walk(data["memory"])
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import shutil
+import tempfile
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+from llmpu.history import HistoryTurn, HistoryJSONEncoder, HistoryJSONDecoder
+
+# rough per turn overhead of the python objects, on top of the text
+TURN_OVERHEAD = 64
+
+
+@dataclass
+class SpilledTurns:
+    """
+    Placeholder left in memory in place of a list of turns that has
+    been spilled to disk
+    """
+
+    file_path: Path
+    size: int
+
+    def load(self) -> list[HistoryTurn]:
+        with open(self.file_path) as file:
+            return json.load(file, cls=HistoryJSONDecoder)
+
+
+class TieredMemoryJSONEncoder(HistoryJSONEncoder):
+    """
+    Encoder for memory that may contain spilled turns, reading them
+    back from disk as they are encoded
+    """
+
+    def default(self, obj):
+        if isinstance(obj, SpilledTurns):
+            return obj.load()
+        return super().default(obj)
+
+
+def turns_size(turns: list[HistoryTurn]) -> int:
+    """
+    Answer the approximate RAM used by a list of turns
+    """
+    return sum(len(turn.role) + len(turn.content) + TURN_OVERHEAD for turn in turns)
+
+
+class TieredMemory:
+    """
+    A memory backend for the LlmProcessingUnit that keeps the turn lists
+    in memory within a RAM budget, in bytes.
+
+    Access recency is tracked for each memory location, and when the
+    resident turn lists exceed the budget the least recently used are
+    spilled to JSON files in a directory of their own inside 'spill_dir',
+    so many instances can share it, leaving a SpilledTurns placeholder in
+    their place. Spilled locations are faulted back in from disk the next
+    time they are accessed. Locations that haven't changed since they
+    were last faulted in are not written out again. 'close' removes the
+    spill files.
+    """
+
+    def __init__(self, spill_dir: Path | str, ram_budget: int = 64 * 1024 * 1024):
+        Path(spill_dir).mkdir(parents=True, exist_ok=True)
+        self._spill_dir = Path(tempfile.mkdtemp(prefix="tiered-", dir=spill_dir))
+        self._ram_budget = ram_budget
+        self._root: dict = dict()
+        self._intern: Callable[[HistoryTurn], HistoryTurn] = None
+        self._resident: OrderedDict[tuple, int] = OrderedDict()
+        self._dirty: set[tuple] = set()
+        self._written: set[tuple] = set()
+        self._resident_size = 0
+        self._spills = 0
+        self._fault_ins = 0
+
+    @property
+    def spill_dir(self) -> Path:
+        return self._spill_dir
+
+    def close(self):
+        """
+        Remove this instance's spill files, any spilled locations can no
+        longer be faulted back in
+        """
+        shutil.rmtree(self._spill_dir, ignore_errors=True)
+        self._written.clear()
+
+    @property
+    def ram_budget(self) -> int:
+        return self._ram_budget
+
+    @ram_budget.setter
+    def ram_budget(self, value: int):
+        self._ram_budget = value
+        self._enforce_budget()
+
+    def _spill_path(self, path: tuple) -> Path:
+        name = hashlib.sha1(json.dumps(path).encode()).hexdigest()
+        return self._spill_dir / f"{name}.json"
+
+    def _parent(self, path: tuple) -> dict:
+        current = self._root
+        for key in path[:-1]:
+            current = current[key]
+        return current
+
+    def attach(self, root: dict, intern: Callable[[HistoryTurn], HistoryTurn] = None):
+        """
+        Start managing the passed memory dictionary, spilling from it
+        straight away if it is over the budget. If 'intern' is passed
+        turns faulted back in from disk are passed through it, such as
+        to share their content through a ContentStore.
+        """
+        self._root = root
+        self._intern = intern
+        self._resident.clear()
+        self._dirty.clear()
+        self._written.clear()
+        self._resident_size = 0
+
+        def walk(node: dict, path: tuple):
+            for key, value in node.items():
+                if isinstance(value, dict):
+                    walk(value, path + (key,))
+                elif isinstance(value, list):
+                    self._track(path + (key,), value)
+
+        walk(root, ())
+        self._enforce_budget()
+
+    def _track(self, path: tuple, turns: list[HistoryTurn]):
+        self._resident_size -= self._resident.pop(path, 0)
+        size = turns_size(turns)
+        self._resident[path] = size
+        self._resident_size += size
+        self._dirty.add(path)
+
+    def access(self, parent: dict, path: list[str | int]) -> list[HistoryTurn]:
+        """
+        Answer the turns at the passed path, whose containing dictionary
+        is 'parent', faulting them back in from disk if they were spilled
+        """
+        path = tuple(path)
+        value = parent[path[-1]]
+
+        if isinstance(value, SpilledTurns):
+            value = value.load()
+            if self._intern is not None:
+                value = [self._intern(turn) for turn in value]
+            parent[path[-1]] = value
+            self._fault_ins += 1
+            self._track(path, value)
+            self._dirty.discard(path)
+            self._enforce_budget()
+        elif path in self._resident:
+            self._resident.move_to_end(path)
+
+        return value
+
+    def update(self, path: list[str | int], turns: list[HistoryTurn]):
+        """
+        Record that the turns at the passed path have been changed
+        """
+        self._track(tuple(path), turns)
+        self._enforce_budget()
+
+    def forget(self, path: list[str | int]):
+        """
+        Stop tracking the passed path, and any paths beneath it, removing
+        their spill files
+        """
+        path = tuple(path)
+        for tracked in [p for p in self._resident if p[: len(path)] == path]:
+            self._resident_size -= self._resident.pop(tracked)
+            self._dirty.discard(tracked)
+        self._written = {p for p in self._written if p[: len(path)] != path}
+
+        def walk(node, node_path: tuple):
+            if isinstance(node, dict):
+                for key, value in node.items():
+                    walk(value, node_path + (key,))
+            self._spill_path(node_path).unlink(missing_ok=True)
+
+        try:
+            walk(self._parent(path)[path[-1]], path)
+        except (KeyError, TypeError):
+            pass
+
+    def _enforce_budget(self):
+        # never spill the most recently used location, it's probably
+        # about to be used
+        while self._resident_size > self._ram_budget and len(self._resident) > 1:
+            path = next(iter(self._resident))
+            try:
+                parent = self._parent(path)
+                parent[path[-1]]
+            except (KeyError, TypeError):
+                # the location has gone from memory, just stop tracking it
+                self.forget(path)
+                continue
+
+            size = self._resident.pop(path)
+            self._resident_size -= size
+            spill_path = self._spill_path(path)
+            if path in self._dirty or path not in self._written:
+                with open(spill_path, mode="w+") as file:
+                    json.dump(parent[path[-1]], file, cls=HistoryJSONEncoder)
+                self._dirty.discard(path)
+                self._written.add(path)
+
+            parent[path[-1]] = SpilledTurns(spill_path, size)
+            self._spills += 1
+
+    def stats(self) -> dict:
+        """
+        Answer the resident size, spill and fault in counts
+        """
+        return {
+            "ram_budget": self._ram_budget,
+            "resident_size": self._resident_size,
+            "resident_locations": len(self._resident),
+            "spills": self._spills,
+            "fault_ins": self._fault_ins,
+        }
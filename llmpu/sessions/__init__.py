@@ -1,3 +1,14 @@
 from .oai_compatible import OAICompatibleChatSession
-from .base import BaseSession
+from .base import BaseSession, SessionError, WrappedSession, Jsonable
+from .scheduler import (
+    RequestScheduler,
+    ScheduledSession,
+    DeadlineExceededError,
+    INTERACTIVE,
+    BATCH,
+)
+from .batch import BatchFileSession, BatchSessionError, read_batch_results
+from .cassette import RecordingSession, ReplaySession, ReplayError
+from .structured import JsonScanner, StreamWatcher
+from .limiter import AdaptiveLimiter, LimitedSession
 from .args import add_args, from_args
@@ -2,6 +2,7 @@ from argparse import ArgumentParser, Namespace
 
 from .base import BaseSession
 from .oai_compatible import OAICompatibleChatSession
+from .limiter import AdaptiveLimiter, LimitedSession
 
 
 def add_args(
@@ -52,16 +53,36 @@ def add_args(
         default=default_api_proj,
         help="project to pass to the AI server api, if applicable",
     )
+    parser.add_argument(
+        "--ai-stream",
+        action="store_true",
+        help="stream responses from the AI server, stopping early on stop words",
+    )
+    parser.add_argument(
+        "--ai-max-concurrency",
+        type=int,
+        default=None,
+        help="adapt the requests in flight to the AI server to its latency, "
+        "up to this many, if given",
+    )
 
 
 def from_args(args: Namespace) -> BaseSession:
     """
     Answer a Session class based on the passed arguments
     """
-    return {"openai_compatible": OAICompatibleChatSession}[args.ai_session_type](
+    session = {"openai_compatible": OAICompatibleChatSession}[args.ai_session_type](
         host=args.ai_host,
         api_key=args.ai_api_key,
         api_org=args.ai_api_org,
         api_proj=args.ai_api_project,
         model=args.ai_model,
+        stream=args.ai_stream,
     )
+
+    if args.ai_max_concurrency is not None:
+        session = LimitedSession(
+            session, AdaptiveLimiter(max_limit=args.ai_max_concurrency)
+        )
+
+    return session
@@ -65,3 +65,50 @@ class BaseSession(ABC):
     @abstractmethod
     def get_response(self, context: str | list[HistoryTurn]) -> dict[str, str]:
         pass
+
+
+class WrappedSession(BaseSession):
+    """
+    Base class for sessions that wrap another session to add some
+    behaviour around its get_response method, such as scheduling or
+    recording. Processors, the token limit and the last response are
+    all those of the wrapped session.
+    """
+
+    def __init__(self, session: BaseSession):
+        self._wrapped: BaseSession = session
+
+    @property
+    def wrapped(self) -> BaseSession:
+        return self._wrapped
+
+    @property
+    def processors(self) -> list[BaseSessionFormatter]:
+        return self._wrapped.processors
+
+    @processors.setter
+    def processors(
+        self, values: list[BaseSessionFormatter | type[BaseSessionFormatter]]
+    ):
+        self._wrapped.processors = values
+
+    @property
+    def token_limit(self) -> int:
+        return self._wrapped.token_limit
+
+    @token_limit.setter
+    def token_limit(self, value: int):
+        self._wrapped.token_limit = value
+
+    @property
+    def last_response(self) -> Jsonable:
+        return self._wrapped.last_response
+
+    def close(self):
+        if hasattr(self._wrapped, "close"):
+            self._wrapped.close()
+
+    def get_response(
+        self, context: str | list[HistoryTurn], *args, **kwargs
+    ) -> dict[str, str]:
+        return self._wrapped.get_response(context, *args, **kwargs)
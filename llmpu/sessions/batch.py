@@ -0,0 +1,146 @@
+import json
+import uuid
+
+from pathlib import Path
+from typing import Iterator
+
+from llmpu.formatters import BaseSessionFormatter
+from llmpu.history import HistoryTurn
+from .base import SessionError, Jsonable
+from .oai_compatible import OAICompatibleChatSession
+
+
+class BatchSessionError(SessionError):
+    pass
+
+
+class BatchFileSession(OAICompatibleChatSession):
+    """
+    A session that, rather than posting each request to the server,
+    appends it to a JSONL file in the OpenAI Batch API input format so
+    the whole batch can be submitted to a Batch API or an offline runner
+    later.
+
+    Each request is tagged with a custom id recording the memory path
+    its result should go to, taken from the 'target' attribute or the
+    'target' argument to 'get_response'. Once the batch has been run,
+    'LlmProcessingUnit.ingest_batch' reads the results file and pushes
+    each completion onto its memory path.
+
+    As no response is available until the batch has been run, each call
+    to 'get_response' answers an empty assistant turn.
+    """
+
+    def __init__(
+        self,
+        file_path: Path | str,
+        path: str = "/v1/chat/completions",
+        initial_processors: list[BaseSessionFormatter] = None,
+        token_limit: int = 1024,
+        extra_props: dict = None,
+        model: str = None,
+    ):
+        super().__init__(
+            "",
+            path,
+            initial_processors,
+            token_limit,
+            extra_props,
+            model=model,
+        )
+        self._file_path = Path(file_path)
+        self._file = None
+        self._request_count = 0
+        self.target: list[str | int] = None
+
+    @property
+    def file_path(self) -> Path:
+        return self._file_path
+
+    @property
+    def request_count(self) -> int:
+        return self._request_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        super().close()
+
+    def get_response(
+        self,
+        context: list[HistoryTurn],
+        token_limit=None,
+        target: list[str | int] = None,
+        structured: bool | dict[str, Jsonable] = None,
+        extra_props: dict = None,
+        stop: str | list[str] = None,
+    ) -> dict[str, str]:
+        mem_path = self.target if target is None else target
+        if not mem_path:
+            raise BatchSessionError("No target memory path set for batch request")
+
+        if self._file is None:
+            self._file = open(self._file_path, mode="a")
+
+        line = {
+            "custom_id": make_custom_id(mem_path),
+            "method": "POST",
+            "url": self._endpoint,
+            "body": self._build_request(
+                context, token_limit, structured, extra_props, stop
+            ),
+        }
+        self._file.write(json.dumps(line, separators=(",", ":")) + "\n")
+        self._request_count += 1
+
+        self._last_response = None
+        return {"role": "assistant", "content": ""}
+
+
+def make_custom_id(mem_path: list[str | int]) -> str:
+    """
+    Answer a unique batch request custom id that encodes the passed
+    memory path
+    """
+    return f"{uuid.uuid4().hex}:{json.dumps(mem_path, separators=(',', ':'))}"
+
+
+def parse_custom_id(custom_id: str) -> list[str | int]:
+    """
+    Answer the memory path encoded in a custom id made by 'make_custom_id'
+    """
+    try:
+        return json.loads(custom_id.split(":", 1)[1])
+    except (IndexError, json.JSONDecodeError):
+        raise BatchSessionError(f"Invalid batch custom id: '{custom_id}'")
+
+
+def read_batch_results(
+    file_path: Path | str,
+) -> Iterator[tuple[list[str | int], dict[str, str] | None, object]]:
+    """
+    Reads an OpenAI Batch API format results file one line at a time,
+    answering a (memory path, message, error) tuple for each line. The
+    message is None for requests that failed, with the error holding
+    whatever the results file recorded about the failure.
+    """
+    with open(file_path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+
+            result = json.loads(line)
+            mem_path = parse_custom_id(result["custom_id"])
+            response = result.get("response") or {}
+
+            if result.get("error") is None and response.get("status_code") == 200:
+                yield mem_path, response["body"]["choices"][0]["message"], None
+            else:
+                yield mem_path, None, result.get("error") or response.get("body")
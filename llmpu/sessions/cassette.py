@@ -0,0 +1,147 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+
+from collections import defaultdict, deque
+from pathlib import Path
+
+from llmpu.history import HistoryTurn, HistoryJSONEncoder
+from .base import BaseSession, SessionError, WrappedSession
+
+
+class ReplayError(SessionError):
+    pass
+
+
+def _open_cassette(file_path: Path, mode: str):
+    # cassettes ending in .gz are transparently gzip compressed
+    if file_path.suffix == ".gz":
+        return gzip.open(file_path, mode=f"{mode}t")
+    return open(file_path, mode=mode)
+
+
+def request_key(context: list[HistoryTurn], args: tuple, kwargs: dict) -> str:
+    """
+    Answer a stable hash identifying a get_response request. Any
+    'on_content' callback isn't part of the request so is left out.
+    """
+    kwargs = {key: value for key, value in kwargs.items() if key != "on_content"}
+    payload = json.dumps(
+        {"context": context, "args": args, "kwargs": kwargs},
+        cls=HistoryJSONEncoder,
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class RecordingSession(WrappedSession):
+    """
+    A session that passes requests on to the wrapped session, recording
+    each request, its response or error, and how long it took to a
+    JSONL cassette file that a ReplaySession can later serve from.
+    Cassettes with a '.gz' suffix are gzip compressed.
+    """
+
+    def __init__(self, session: BaseSession, file_path: Path | str):
+        super().__init__(session)
+        self._file_path = Path(file_path)
+        self._file = _open_cassette(self._file_path, "a")
+        self._lock = threading.Lock()
+
+    @property
+    def file_path(self) -> Path:
+        return self._file_path
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        super().close()
+
+    def _record(self, entry: dict):
+        line = json.dumps(entry, cls=HistoryJSONEncoder, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def get_response(
+        self, context: list[HistoryTurn], *args, **kwargs
+    ) -> dict[str, str]:
+        entry = {"key": request_key(context, args, kwargs), "context": context}
+        start = time.perf_counter()
+        try:
+            response = self._wrapped.get_response(context, *args, **kwargs)
+        except (SessionError, OSError) as error:
+            entry |= {"elapsed": time.perf_counter() - start, "error": str(error)}
+            self._record(entry)
+            raise
+
+        entry |= {
+            "elapsed": time.perf_counter() - start,
+            "response": response,
+            "raw": self._wrapped.last_response,
+        }
+        self._record(entry)
+        return response
+
+
+class ReplaySession(BaseSession):
+    """
+    A session that answers requests from a cassette recorded by a
+    RecordingSession without any network access.
+
+    By default each request is matched against the recorded requests
+    and answered with the matching recorded response, repeated
+    requests are answered in the order they were recorded. With
+    'match_requests' False recorded responses are just served in order.
+
+    If 'latency_scale' is set each response is delayed by the recorded
+    time taken multiplied by the scale, so 1.0 reproduces the recorded
+    latencies, and 0.5 halves them. An 'on_content' callback passed to
+    get_response is called with the whole recorded content.
+    """
+
+    def __init__(
+        self,
+        file_path: Path | str,
+        latency_scale: float = None,
+        match_requests: bool = True,
+    ):
+        super().__init__("", "")
+        self._latency_scale = latency_scale
+        self._match_requests = match_requests
+        self._lock = threading.Lock()
+
+        self._entries: dict[str, deque[dict]] = defaultdict(deque)
+        with _open_cassette(Path(file_path), "r") as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    key = entry["key"] if match_requests else None
+                    self._entries[key].append(entry)
+
+    def get_response(
+        self, context: list[HistoryTurn], *args, **kwargs
+    ) -> dict[str, str]:
+        key = request_key(context, args, kwargs) if self._match_requests else None
+
+        with self._lock:
+            if not self._entries.get(key):
+                raise ReplayError("No recorded response for request")
+            entry = self._entries[key].popleft()
+
+        if self._latency_scale:
+            time.sleep(entry["elapsed"] * self._latency_scale)
+
+        if "error" in entry:
+            raise ReplayError(entry["error"])
+
+        self._last_response = entry["raw"]
+        on_content = kwargs.get("on_content")
+        if on_content is not None and entry["response"].get("content"):
+            on_content(entry["response"]["content"])
+
+        return entry["response"]
@@ -0,0 +1,175 @@
+import threading
+import time
+
+from llmpu.history import HistoryTurn
+from .base import BaseSession, SessionError, WrappedSession
+
+
+class AdaptiveLimiter:
+    """
+    Adapts the number of requests allowed in flight to a server with an
+    additive increase, multiplicative decrease (AIMD) algorithm driven by
+    the latency and errors it observes.
+
+    The baseline latency is the lowest seen, allowed to creep up by at
+    most 'baseline_drift' each 'baseline_window' requests so it can
+    follow a server that has genuinely slowed down, but not one that is
+    just overloaded. While requests come back within
+    'latency_tolerance' times the baseline without errors, and the limit
+    is actually being used, the limit grows by about one request each
+    time a limit's worth of requests complete. An error, or a request
+    slower than the tolerance allows, instead cuts the limit by the
+    'backoff' factor, at most once per limit's worth of requests, as the
+    server is starting to queue requests rather than process them.
+
+    Requests can be gated directly with 'acquire' and 'release', or the
+    limiter passed to a LimitedSession or a RequestScheduler.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        latency_tolerance: float = 1.5,
+        backoff: float = 0.7,
+        baseline_window: int = 100,
+        baseline_drift: float = 0.01,
+    ):
+        if min_limit < 1:
+            raise ValueError("min_limit must be at least 1")
+        if min_limit > max_limit:
+            raise ValueError("min_limit can't be more than max_limit")
+
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._latency_tolerance = latency_tolerance
+        self._backoff = backoff
+        self._baseline_window = baseline_window
+        self._baseline_drift = baseline_drift
+
+        self._lock = threading.Condition()
+        self._in_flight = 0
+        self._baseline: float = None
+        self._window_min: float = None
+        self._window_count = 0
+        self._since_decrease = 0
+        self._samples = 0
+        self._errors = 0
+        self._decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def acquire(self):
+        """
+        Block until there is room under the limit for another request
+        """
+        with self._lock:
+            while self._in_flight >= int(self._limit):
+                self._lock.wait()
+            self._in_flight += 1
+
+    def release(self, latency: float, error: bool = False):
+        """
+        Mark a request acquired with 'acquire' as complete, recording how
+        long it took and whether it failed
+        """
+        with self._lock:
+            self._in_flight -= 1
+            self._record(latency, error, self._in_flight + 1)
+            self._lock.notify_all()
+
+    def record(self, latency: float, error: bool = False, in_flight: int = None):
+        """
+        Record the latency and outcome of a request gated elsewhere, with
+        the number of requests that were in flight when it completed
+        """
+        with self._lock:
+            self._record(latency, error, self.limit if in_flight is None else in_flight)
+            self._lock.notify_all()
+
+    def _record(self, latency: float, error: bool, in_flight: int):
+        # called with the lock held
+        self._samples += 1
+        self._since_decrease += 1
+
+        if not error:
+            self._baseline = (
+                latency if self._baseline is None else min(self._baseline, latency)
+            )
+            self._window_min = (
+                latency if self._window_min is None else min(self._window_min, latency)
+            )
+            self._window_count += 1
+            if self._window_count >= self._baseline_window:
+                self._baseline = min(
+                    self._window_min, self._baseline * (1 + self._baseline_drift)
+                )
+                self._window_min = None
+                self._window_count = 0
+        else:
+            self._errors += 1
+
+        overloaded = error or latency > self._baseline * self._latency_tolerance
+        if overloaded:
+            # only back off once per round of requests, the others in the
+            # same round were probably slowed by the same overload
+            if self._since_decrease >= int(self._limit):
+                self._limit = max(self._min_limit, self._limit * self._backoff)
+                self._since_decrease = 0
+                self._decreases += 1
+        elif in_flight >= int(self._limit):
+            self._limit = min(self._max_limit, self._limit + 1.0 / self._limit)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "baseline_latency": self._baseline,
+                "samples": self._samples,
+                "errors": self._errors,
+                "decreases": self._decreases,
+            }
+
+
+class LimitedSession(WrappedSession):
+    """
+    A session that only allows as many requests in flight to the wrapped
+    session as an AdaptiveLimiter currently permits, blocking any others
+    until there's room. Anything calling into the session from several
+    threads, such as a thread pool, is limited automatically.
+    """
+
+    def __init__(self, session: BaseSession, limiter: AdaptiveLimiter = None):
+        super().__init__(session)
+        self._limiter = AdaptiveLimiter() if limiter is None else limiter
+
+    @property
+    def limiter(self) -> AdaptiveLimiter:
+        return self._limiter
+
+    @property
+    def limit(self) -> int:
+        return self._limiter.limit
+
+    def get_response(
+        self, context: list[HistoryTurn], *args, **kwargs
+    ) -> dict[str, str]:
+        self._limiter.acquire()
+        error = False
+        start = time.monotonic()
+        try:
+            return self._wrapped.get_response(context, *args, **kwargs)
+        except (SessionError, OSError):
+            error = True
+            raise
+        finally:
+            self._limiter.release(time.monotonic() - start, error)
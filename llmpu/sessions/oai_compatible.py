@@ -1,8 +1,13 @@
+import json
 import requests
 
+from typing import Callable
+
 from llmpu.formatters import BaseSessionFormatter
 from llmpu.history import HistoryTurn
-from .base import BaseSession, SessionError
+from .base import BaseSession, SessionError, Jsonable
+from .stop_words import StopWordWatcher, find_stop, merge_stop_words
+from .structured import JsonScanner, StreamWatcher, structured_props
 
 
 class OAISessionError(SessionError):
@@ -12,6 +17,13 @@ class OAISessionError(SessionError):
 class OAICompatibleChatSession(BaseSession):
     """
     A session using an OpenAI Chat completions compatible endpoint
+
+    The stop words of the processors are sent along with any passed in
+    'extra_props' or to 'get_response', and are also enforced on the
+    response here in case the server ignores them. If 'stream' is set
+    responses are streamed, so the response can be closed as soon as a
+    stop word arrives. Responses are also streamed when 'get_response'
+    is passed an 'on_content' callback.
     """
 
     def __init__(
@@ -25,6 +37,7 @@ class OAICompatibleChatSession(BaseSession):
         api_key: str = None,
         api_org: str = None,
         api_proj: str = None,
+        stream: bool = False,
     ):
         super().__init__(host, path, initial_processors, token_limit, extra_props)
 
@@ -33,6 +46,7 @@ class OAICompatibleChatSession(BaseSession):
         self._api_org: str = api_org
         self._api_proj: str = api_proj
         self._model: str = model
+        self.stream: bool = stream
 
         if api_key is not None:
             self._session.headers["Authorization"] = f"Bearer {api_key}"
@@ -46,26 +60,178 @@ class OAICompatibleChatSession(BaseSession):
     def close(self):
         self._session.close()
 
-    def get_response(
-        self, context: list[HistoryTurn], token_limit=None
-    ) -> dict[str, str]:
+    def _build_request(
+        self,
+        context: list[HistoryTurn],
+        token_limit: int = None,
+        structured: bool | dict[str, Jsonable] = None,
+        extra_props: dict = None,
+        stop: str | list[str] = None,
+    ) -> dict:
         # do any preprocessing of what we're going to send
+        request_context = context
         for processor in self._processors:
             request_context = processor.apply(context)
 
-        # Send the final request to AI chat server
+        props = self._extra_props
+        if structured:
+            props = props | structured_props(structured)
+        if extra_props is not None:
+            props = props | extra_props
+
+        stop_words = merge_stop_words(
+            *[processor.stop_words for processor in self._processors],
+            props.get("stop"),
+            stop,
+        )
+        if stop_words:
+            props = props | {"stop": stop_words}
+
+        return props | {
+            "messages": request_context,
+            "max_tokens": self._token_limit if token_limit is None else token_limit,
+        }
+
+    def _stream_response(
+        self,
+        request: dict,
+        watchers: list[StreamWatcher],
+        on_content: Callable[[str], None] = None,
+    ) -> dict[str, str]:
+        """
+        Send the request with streaming on, feeding the content to the
+        watchers as it arrives and closing the response as soon as any
+        of them say generation can stop. Content is passed on to
+        'on_content' once it's certain not to be part of a stop word.
+        """
+        # hold back enough content to cover the start of a stop word
+        held_back = max((len(stop) for stop in request.get("stop", [])), default=1) - 1
+        sent = 0
+
         response: requests.Response = self._session.post(
-            self._endpoint,
-            json=self._extra_props
-            | {
-                "messages": request_context,
-                "max_tokens": self._token_limit if token_limit is None else token_limit,
-            },
+            self._endpoint, json=request | {"stream": True}, stream=True
+        )
+
+        with response:
+            if not response.ok:
+                self._last_response = response.json()
+                raise OAISessionError(self._last_response)
+
+            # event streams are UTF-8, but requests assumes ISO-8859-1 for
+            # text without a charset
+            response.encoding = "utf-8"
+
+            role = "assistant"
+            content = ""
+            finish_reason = None
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+
+                chunk = json.loads(data)
+                if not chunk.get("choices"):
+                    continue
+
+                choice = chunk["choices"][0]
+                delta = choice.get("delta") or {}
+                role = delta.get("role") or role
+                finish_reason = choice.get("finish_reason") or finish_reason
+
+                text = delta.get("content") or ""
+                content += text
+                cuts = [
+                    cut
+                    for cut in (watcher.feed(text) for watcher in watchers)
+                    if cut is not None
+                ]
+                if cuts:
+                    content = content[: min(cuts)]
+                    finish_reason = "stop"
+                    break
+
+                if on_content is not None and len(content) - held_back > sent:
+                    on_content(content[sent : len(content) - held_back])
+                    sent = len(content) - held_back
+
+        if on_content is not None and len(content) > sent:
+            on_content(content[sent:])
+
+        message = {"role": role, "content": content}
+        self._last_response = {
+            "object": "chat.completion",
+            "choices": [
+                {"index": 0, "message": message, "finish_reason": finish_reason}
+            ],
+        }
+        return message
+
+    def get_response(
+        self,
+        context: list[HistoryTurn],
+        token_limit=None,
+        structured: bool | dict[str, Jsonable] = None,
+        extra_props: dict = None,
+        stop: str | list[str] = None,
+        on_content: Callable[[str], None] = None,
+    ) -> dict[str, str]:
+        """
+        Answer the server's response to the passed context, cut short at
+        the first stop word.
+
+        If 'structured' is True the server is asked for a JSON object,
+        or if it is a dict, for JSON following that schema. The response
+        is then streamed and parsed as it arrives, stopping as soon as
+        the JSON is complete, and the parsed value is answered under the
+        'parsed' key, or None if the response wasn't valid JSON.
+
+        'extra_props' are merged into the request for just this call, for
+        example to pass a grammar to a server that supports them, and
+        'stop' adds to the stop words for just this call.
+
+        If 'on_content' is passed the response is streamed, and it is
+        called with each piece of the content as it arrives.
+        """
+        request = self._build_request(
+            context, token_limit, structured, extra_props, stop
         )
+        stop_words = request.get("stop", [])
+
+        watchers: list[StreamWatcher] = []
+        if stop_words:
+            watchers.append(StopWordWatcher(stop_words))
+
+        if (self.stream or on_content is not None) and not structured:
+            return self._stream_response(request, watchers, on_content)
+
+        if structured:
+            scanner = JsonScanner()
+            message = self._stream_response(request, watchers + [scanner], on_content)
+            try:
+                parsed = (
+                    json.loads(message["content"][scanner.start : scanner.end])
+                    if scanner.complete
+                    else None
+                )
+            except json.JSONDecodeError:
+                parsed = None
+            return message | {"parsed": parsed}
+
+        # Send the final request to AI chat server
+        response: requests.Response = self._session.post(self._endpoint, json=request)
 
         self._last_response = response.json()
         try:
             response.raise_for_status()
-            return self._last_response["choices"][0]["message"]
         except requests.exceptions.HTTPError:
             raise OAISessionError(self._last_response)
+
+        message = self._last_response["choices"][0]["message"]
+        cut = find_stop(message.get("content") or "", stop_words)
+        if cut is not None:
+            message = message | {"content": message["content"][:cut]}
+
+        return message
@@ -0,0 +1,300 @@
+import heapq
+import itertools
+import threading
+import time
+
+from collections import deque
+from dataclasses import dataclass, field
+
+from llmpu.history import HistoryTurn
+from .base import BaseSession, SessionError, WrappedSession
+from .limiter import AdaptiveLimiter
+
+# Priority classes, lower values are always dispatched first
+INTERACTIVE = 0
+BATCH = 10
+
+
+class DeadlineExceededError(SessionError):
+    pass
+
+
+@dataclass(order=True)
+class _Ticket:
+    priority: int
+    finish_tag: float
+    seq: int
+    start_tag: float = field(compare=False)
+    tenant: str = field(compare=False)
+    weight: float = field(compare=False)
+    deadline: float | None = field(compare=False)
+    enqueued: float = field(compare=False)
+    granted: bool = field(default=False, compare=False)
+    abandoned: bool = field(default=False, compare=False)
+
+
+@dataclass
+class _WaitStats:
+    queued: int = 0
+    dispatched: int = 0
+    expired: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+
+class RequestScheduler:
+    """
+    Schedules requests to a backend shared between several sessions.
+
+    Requests are dispatched strictly by priority class, so queued
+    INTERACTIVE requests always go before queued BATCH ones. Within
+    a priority class requests from different tenants are interleaved
+    by weighted fair queuing, so a tenant with weight 2 gets twice the
+    share of a tenant with weight 1 when both have requests waiting.
+    Each priority class is queued fairly on its own, so a tenant's
+    backlog in one class doesn't hold back its requests in another.
+
+    At most 'max_concurrency' requests are allowed in flight to the
+    backend at once, or if an AdaptiveLimiter is passed instead, as many
+    as it currently allows given the latencies and errors it sees.
+    Requests that are still queued when their deadline passes are
+    dropped and fail with a DeadlineExceededError.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int | AdaptiveLimiter = 4,
+        tenant_weights: dict[str, float] = None,
+        default_weight: float = 1.0,
+    ):
+        self._max_concurrency = max_concurrency
+        self._default_weight = default_weight
+        self._weights: dict[str, float] = dict(tenant_weights or {})
+
+        self._lock = threading.Condition()
+        # the heap only holds the ticket at the head of each (priority,
+        # tenant) flow, the rest wait in their flow's queue so their tags
+        # are only assigned once the tickets before them are done with
+        self._queue: list[_Ticket] = []
+        self._flows: dict[tuple[int, str], deque[_Ticket]] = {}
+        self._seq = itertools.count()
+        self._virtual_time: dict[int, float] = {}
+        self._flow_finish: dict[tuple[int, str], float] = {}
+        self._in_flight = 0
+        self._stats: dict[int, _WaitStats] = {}
+
+    @property
+    def max_concurrency(self) -> int:
+        if isinstance(self._max_concurrency, AdaptiveLimiter):
+            return self._max_concurrency.limit
+        return self._max_concurrency
+
+    @max_concurrency.setter
+    def max_concurrency(self, value: int | AdaptiveLimiter):
+        with self._lock:
+            self._max_concurrency = value
+            self._dispatch()
+
+    def set_weight(self, tenant: str, weight: float):
+        """
+        Set the fair queuing weight for the passed tenant
+        """
+        if weight <= 0:
+            raise ValueError(f"Invalid weight for tenant '{tenant}': {weight}")
+
+        with self._lock:
+            self._weights[tenant] = weight
+
+    def acquire(
+        self, tenant: str, priority: int = INTERACTIVE, deadline: float = None
+    ) -> _Ticket:
+        """
+        Queue a request and block until it may be sent to the backend.
+        'deadline' is the number of seconds the request may wait in the
+        queue. Answers a ticket that must be passed to 'release' once
+        the request completes.
+        """
+        now = time.monotonic()
+        expires = None if deadline is None else now + deadline
+
+        with self._lock:
+            ticket = _Ticket(
+                priority=priority,
+                finish_tag=0.0,
+                seq=next(self._seq),
+                start_tag=0.0,
+                tenant=tenant,
+                weight=self._weights.get(tenant, self._default_weight),
+                deadline=expires,
+                enqueued=now,
+            )
+
+            stats = self._stats.setdefault(priority, _WaitStats())
+            stats.queued += 1
+            flow = self._flows.setdefault((priority, tenant), deque())
+            flow.append(ticket)
+            if len(flow) == 1:
+                self._schedule_head(flow)
+            self._dispatch()
+
+            while not ticket.granted:
+                timeout = None if expires is None else expires - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    ticket.abandoned = True
+                    stats.queued -= 1
+                    stats.expired += 1
+                    raise DeadlineExceededError(
+                        f"Request for tenant '{tenant}' expired after waiting "
+                        f"{time.monotonic() - now:.3f}s in the queue"
+                    )
+                self._lock.wait(timeout)
+
+        return ticket
+
+    def release(self, ticket: _Ticket, latency: float = None, error: bool = False):
+        """
+        Mark a request acquired with 'acquire' as complete, freeing its
+        slot for the next queued request. The request's latency and
+        whether it failed are passed on to any AdaptiveLimiter.
+        """
+        with self._lock:
+            if isinstance(self._max_concurrency, AdaptiveLimiter) and latency:
+                self._max_concurrency.record(latency, error, self._in_flight)
+            self._in_flight -= 1
+            self._dispatch()
+
+    def _schedule_head(self, flow: deque[_Ticket]):
+        # called with the lock held, tags the ticket at the head of the
+        # flow and puts it on the heap
+        ticket = flow[0]
+        flow_key = (ticket.priority, ticket.tenant)
+        ticket.start_tag = max(
+            self._virtual_time.get(ticket.priority, 0.0),
+            self._flow_finish.get(flow_key, 0.0),
+        )
+        ticket.finish_tag = ticket.start_tag + 1.0 / ticket.weight
+        heapq.heappush(self._queue, ticket)
+
+    def _next_in_flow(self, ticket: _Ticket):
+        # called with the lock held, after the head ticket leaves its flow
+        flow_key = (ticket.priority, ticket.tenant)
+        flow = self._flows[flow_key]
+        flow.popleft()
+        while flow and flow[0].abandoned:
+            flow.popleft()
+
+        if flow:
+            self._schedule_head(flow)
+        else:
+            del self._flows[flow_key]
+
+    def _dispatch(self):
+        # called with the lock held
+        granted = False
+        now = time.monotonic()
+        while self._queue and self._in_flight < self.max_concurrency:
+            ticket = heapq.heappop(self._queue)
+            self._next_in_flow(ticket)
+
+            # expired tickets don't advance their flow's finish tag, the
+            # waiting thread will notice the expiry itself when woken
+            if ticket.abandoned:
+                continue
+            if ticket.deadline is not None and ticket.deadline <= now:
+                granted = True
+                continue
+
+            ticket.granted = True
+            self._in_flight += 1
+            self._flow_finish[(ticket.priority, ticket.tenant)] = ticket.finish_tag
+            self._virtual_time[ticket.priority] = max(
+                self._virtual_time.get(ticket.priority, 0.0), ticket.start_tag
+            )
+
+            stats = self._stats[ticket.priority]
+            waited = now - ticket.enqueued
+            stats.queued -= 1
+            stats.dispatched += 1
+            stats.total_wait += waited
+            stats.max_wait = max(stats.max_wait, waited)
+            granted = True
+
+        if granted:
+            self._lock.notify_all()
+
+    def stats(self) -> dict:
+        """
+        Answer a snapshot of the scheduler's queue depth and wait time
+        statistics, broken down by priority class.
+        """
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": sum(stats.queued for stats in self._stats.values()),
+                "priorities": {
+                    priority: {
+                        "queue_depth": stats.queued,
+                        "dispatched": stats.dispatched,
+                        "expired": stats.expired,
+                        "mean_wait": (
+                            stats.total_wait / stats.dispatched
+                            if stats.dispatched
+                            else 0.0
+                        ),
+                        "max_wait": stats.max_wait,
+                    }
+                    for priority, stats in sorted(self._stats.items())
+                },
+            }
+
+
+class ScheduledSession(WrappedSession):
+    """
+    A session that queues each request through a RequestScheduler
+    before passing it on to the wrapped session. Several scheduled
+    sessions, with different tenants and priorities, can share the
+    same scheduler and backend session.
+    """
+
+    def __init__(
+        self,
+        session: BaseSession,
+        scheduler: RequestScheduler,
+        tenant: str = "default",
+        priority: int = INTERACTIVE,
+        deadline: float = None,
+    ):
+        super().__init__(session)
+        self._scheduler = scheduler
+        self.tenant = tenant
+        self.priority = priority
+        self.deadline = deadline
+
+    @property
+    def scheduler(self) -> RequestScheduler:
+        return self._scheduler
+
+    def get_response(
+        self,
+        context: list[HistoryTurn],
+        *args,
+        tenant: str = None,
+        priority: int = None,
+        deadline: float = None,
+        **kwargs,
+    ) -> dict[str, str]:
+        ticket = self._scheduler.acquire(
+            self.tenant if tenant is None else tenant,
+            self.priority if priority is None else priority,
+            self.deadline if deadline is None else deadline,
+        )
+        error = False
+        start = time.monotonic()
+        try:
+            return self._wrapped.get_response(context, *args, **kwargs)
+        except (SessionError, OSError):
+            error = True
+            raise
+        finally:
+            self._scheduler.release(ticket, time.monotonic() - start, error)
@@ -0,0 +1,46 @@
+def merge_stop_words(*stop_lists: str | list[str] | None) -> list[str]:
+    """
+    Answer the stop words from all the passed stop lists, or single stop
+    words, in order and without duplicates
+    """
+    merged: list[str] = []
+    for stop_list in stop_lists:
+        if stop_list is None:
+            continue
+        for stop in [stop_list] if isinstance(stop_list, str) else stop_list:
+            if stop and stop not in merged:
+                merged.append(stop)
+
+    return merged
+
+
+def find_stop(content: str, stop_words: list[str], start: int = 0) -> int | None:
+    """
+    Answer the position of the earliest stop word in the content at or
+    after 'start', or None if there isn't one
+    """
+    found = [
+        position
+        for position in (content.find(stop, start) for stop in stop_words)
+        if position >= 0
+    ]
+    return min(found) if found else None
+
+
+class StopWordWatcher:
+    """
+    Watches streamed content for any of a list of stop words, asking for
+    generation to stop, and the content to be cut, at the first one.
+    """
+
+    def __init__(self, stop_words: list[str]):
+        self._stop_words = stop_words
+        self._overlap = max((len(stop) for stop in stop_words), default=1) - 1
+        self._content = ""
+
+    def feed(self, text: str) -> int | None:
+        # only search the new text, plus enough of the old to catch
+        # a stop word split across pieces
+        start = max(len(self._content) - self._overlap, 0)
+        self._content += text
+        return find_stop(self._content, self._stop_words, start)
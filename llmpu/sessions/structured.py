@@ -0,0 +1,87 @@
+from typing import Protocol
+
+from .base import Jsonable
+
+
+class StreamWatcher(Protocol):
+    """
+    Watches the content of a streamed response as it arrives, deciding
+    when generation can be stopped early
+    """
+
+    def feed(self, text: str) -> int | None:
+        """
+        Feed the next piece of streamed content. Answers None to carry on,
+        or the length of the content received so far that should be kept
+        if generation should stop now.
+        """
+        ...
+
+
+class JsonScanner:
+    """
+    Scans streamed content incrementally for the first complete top-level
+    JSON object or array, ignoring anything before it such as the opening
+    of a markdown code fence.
+    """
+
+    def __init__(self):
+        self.start: int = None
+        self.end: int = None
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, text: str) -> int | None:
+        if self.complete:
+            return self.end
+
+        for char in text:
+            self._pos += 1
+
+            if self.start is None:
+                if char in "{[":
+                    self.start = self._pos - 1
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = self._pos
+                    return self.end
+
+        return None
+
+
+def structured_props(structured: bool | dict[str, Jsonable]) -> dict[str, Jsonable]:
+    """
+    Answer the request properties asking an OpenAI compatible server for
+    structured output. 'structured' is either True for any JSON object,
+    or a JSON schema the response must follow.
+    """
+    if isinstance(structured, dict):
+        return {
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "response", "schema": structured},
+            }
+        }
+
+    return {"response_format": {"type": "json_object"}}
@@ -0,0 +1,241 @@
+import cProfile
+import functools
+import inspect
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+from pathlib import Path
+from typing import Callable
+
+
+class Tracer:
+    """
+    Records each traced operation with its start time, duration, thread
+    and a description of its arguments, such as memory paths and payload
+    sizes, for export as Chrome/Perfetto trace event JSON.
+
+    Operations named in 'profile_ops' are also run under cProfile, one
+    profile per operation name. Only one profiler can be active at a
+    time, so they are run one at a time across all threads.
+
+    Operations named in 'tracemalloc_ops' have the memory they allocate
+    and their peak memory use recorded, along with a tracemalloc snapshot
+    taken after the latest run of each. tracemalloc is only running while
+    one of them is, but it measures the whole process, so the numbers are
+    only meaningful when nothing else is running on other threads.
+
+    Can be used as a context manager, closing it on exit.
+    """
+
+    def __init__(
+        self,
+        profile_ops: set[str] = None,
+        tracemalloc_ops: set[str] = None,
+    ):
+        self._profile_ops = set(profile_ops or ())
+        self._tracemalloc_ops = set(tracemalloc_ops or ())
+        self._events: list[dict] = []
+        self._threads: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter_ns()
+        self._profiles: dict[str, cProfile.Profile] = {}
+        self._profile_lock = threading.Lock()
+        self._snapshots: dict[str, tracemalloc.Snapshot] = {}
+        self._measuring = 0
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def events(self) -> list[dict]:
+        with self._lock:
+            return list(self._events)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+    def close(self):
+        """
+        Stop tracemalloc if this tracer started it, and no operation is
+        still measuring
+        """
+        with self._lock:
+            if self._started_tracemalloc and self._measuring == 0:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+    def _start_measuring(self):
+        # tracemalloc slows everything down, so it's only kept running
+        # while an operation that's measured is
+        with self._lock:
+            if self._measuring == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            self._measuring += 1
+
+    def _stop_measuring(self):
+        with self._lock:
+            self._measuring -= 1
+            if self._measuring == 0 and self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+    def run(self, op: str, func: Callable, describe: Callable[[], dict] = None):
+        """
+        Run 'func', recording it as the passed operation. 'describe' is
+        called after 'func' returns to answer the arguments to record.
+        """
+        profile = None
+        if op in self._profile_ops and not getattr(self._local, "profiling", False):
+            with self._lock:
+                profile = self._profiles.setdefault(op, cProfile.Profile())
+
+        measure_memory = op in self._tracemalloc_ops
+        if measure_memory:
+            self._start_measuring()
+            memory_before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+        args = dict()
+        start = time.perf_counter_ns()
+        try:
+            if profile is not None:
+                self._profile_lock.acquire()
+                self._local.profiling = True
+                profile.enable()
+            try:
+                result = func()
+            finally:
+                if profile is not None:
+                    profile.disable()
+                    self._local.profiling = False
+                    self._profile_lock.release()
+
+            if describe is not None:
+                args = describe()
+            return result
+        except Exception as error:
+            args["error"] = repr(error)
+            raise
+        finally:
+            end = time.perf_counter_ns()
+            if measure_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                args["alloc_bytes"] = current - memory_before
+                args["peak_bytes"] = peak - memory_before
+                snapshot = tracemalloc.take_snapshot()
+                with self._lock:
+                    self._snapshots[op] = snapshot
+                self._stop_measuring()
+            self._record(op, start, end, args)
+
+    def _record(self, op: str, start: int, end: int, args: dict):
+        thread = threading.current_thread()
+        event = {
+            "name": op,
+            "cat": "llmpu",
+            "ph": "X",
+            "ts": (start - self._origin) / 1000,
+            "dur": (end - start) / 1000,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self._lock:
+            self._events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+
+    def export_chrome(self, file_path: Path | str):
+        """
+        Write the recorded operations to a Chrome/Perfetto trace event
+        JSON file, which can be opened with chrome://tracing or
+        https://ui.perfetto.dev
+        """
+        with self._lock:
+            thread_names = [
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+                for tid, name in self._threads.items()
+            ]
+            trace = {
+                "traceEvents": thread_names + self._events,
+                "displayTimeUnit": "ms",
+            }
+
+        with open(file_path, mode="w+") as file:
+            json.dump(trace, file, default=str)
+
+    def profile_stats(self, op: str) -> pstats.Stats:
+        """
+        Answer the cProfile statistics gathered for the passed operation
+        """
+        if op not in self._profiles:
+            raise KeyError(f"No profile for operation '{op}'")
+        with self._profile_lock:
+            return pstats.Stats(self._profiles[op])
+
+    def dump_profile(self, op: str, file_path: Path | str):
+        """
+        Write the cProfile statistics gathered for the passed operation to
+        a file, for use with pstats, snakeviz and the like
+        """
+        self.profile_stats(op).dump_stats(file_path)
+
+    def snapshot(self, op: str) -> tracemalloc.Snapshot:
+        """
+        Answer the tracemalloc snapshot taken after the latest run of the
+        passed operation
+        """
+        if op not in self._snapshots:
+            raise KeyError(f"No tracemalloc snapshot for operation '{op}'")
+        return self._snapshots[op]
+
+
+def traced(op: str, describe: Callable[[object, dict], dict] = None):
+    """
+    Decorator for methods of objects with a '_tracer' attribute, that
+    records calls to the method as the passed operation when the tracer
+    is set. 'describe' is called with the object and the method's bound
+    arguments, after the call, to answer the arguments to record.
+
+    When '_tracer' is None the method is called directly.
+    """
+
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            tracer: Tracer = self._tracer
+            if tracer is None:
+                return method(self, *args, **kwargs)
+
+            def describe_call():
+                bound = signature.bind(self, *args, **kwargs)
+                bound.apply_defaults()
+                return describe(self, bound.arguments)
+
+            return tracer.run(
+                op,
+                lambda: method(self, *args, **kwargs),
+                None if describe is None else describe_call,
+            )
+
+        return wrapper
+
+    return decorator